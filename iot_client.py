@@ -1,17 +1,148 @@
 
 # Importaciones 
-import random  # Para generación de números aleatorios/primos
+import os      # Para entropía del sistema (os.urandom)
+import random  # Para generación del ID del dispositivo
 import struct  # Para empaquetar datos en binario
 import json    # Para guardar datos en formato legible
-from enum import Enum  # Para manejar tipos de mensaje
+import sys     # Para acciones por línea de comandos
+from array import array        # Tabla de llaves como uint64 contiguos
+from collections import deque  # Reserva de semillas pregeneradas
+from itertools import cycle    # Rotación de llaves en cifrado por lotes
 
-# Definición de tipos de mensaje usando enumeración
-class TipoMensaje(Enum):
-    """Tipos de mensajes disponibles en el protocolo"""
-    FCM = 0  # First Contact Message (Establecer conexión)
-    RM = 1   # Regular Message (Mensaje cifrado)
-    KUM = 2  # Key Update Message (Actualizar llaves)
-    LCM = 3  # Last Contact Message (Terminar conexión)
+# Tipos de mensajes disponibles en el protocolo (2 bits de la cabecera)
+FCM = 0  # First Contact Message (Establecer conexión)
+RM = 1   # Regular Message (Mensaje cifrado)
+KUM = 2  # Key Update Message (Actualizar llaves)
+LCM = 3  # Last Contact Message (Terminar conexión)
+
+# Mostrar detalles internos (llaves, valores binarios) por consola
+DEBUG = False
+
+# Registrar cada RM en formato JSON (rm.jsonl); apagado por defecto
+LOG_JSON = False
+
+# Formatos precompilados de los mensajes
+_HDR = struct.Struct('B')     # Cabecera: ID (6 bits) + Tipo (2 bits)
+_PQS = struct.Struct('QQQ')   # Parámetros P, Q, S
+_RM = struct.Struct('=BBQ')   # Cabecera + índice de llave + cifrado (sin relleno)
+_TAM_PARAMS = _HDR.size + _PQS.size  # Tamaño de FCM/KUM (25 bytes)
+
+def _criba(limite):
+    """Criba de Eratóstenes: primos menores a limite"""
+    es_primo = bytearray([1]) * limite
+    es_primo[0:2] = b'\x00\x00'
+    for i in range(2, int(limite ** 0.5) + 1):
+        if es_primo[i]:
+            es_primo[i * i::i] = bytes(len(range(i * i, limite, i)))
+    return tuple(i for i in range(limite) if es_primo[i])
+
+# Primos menores a 1000 para descartar candidatos por división directa
+_LIMITE_CRIBA = 1000
+_PRIMOS_PEQUENOS = _criba(_LIMITE_CRIBA)
+
+# Testigos de Miller-Rabin: determinista para todo n < 2^64
+_TESTIGOS_MR = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+def _es_probable_primo(n):
+    """
+    Prueba de primalidad:
+    1. División entre primos pequeños
+    2. Miller-Rabin con testigos fijos (exacto para n < 2^64)
+    """
+    if n < 2:
+        return False
+    for p in _PRIMOS_PEQUENOS:
+        if n % p == 0:
+            return n == p
+    
+    # Sin divisores menores a la raíz: la división basta
+    if n < _LIMITE_CRIBA * _LIMITE_CRIBA:
+        return True
+    
+    # Escribir n - 1 = d * 2^r con d impar
+    d = n - 1
+    r = 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    
+    for a in _TESTIGOS_MR:
+        x = pow(a, d, n)  # Exponenciación modular en C
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False  # Testigo de que n es compuesto
+    return True
+
+# Reserva de semillas: se rellena por lotes con una sola llamada a os.urandom
+_LOTE_SEMILLAS = struct.Struct('256Q')
+_reserva_semillas = deque()
+
+def _nueva_semilla():
+    """Entrega una semilla S de 64 bits tomada de la reserva"""
+    if not _reserva_semillas:
+        _reserva_semillas.extend(_LOTE_SEMILLAS.unpack(os.urandom(_LOTE_SEMILLAS.size)))
+    return _reserva_semillas.popleft()
+
+# --- Funciones criptográficas ---
+# Todas las operaciones trabajan sobre enteros de 64 bits
+MASK64 = (1 << 64) - 1
+
+def funcion_mezcla(x, y):
+    """
+    Función scrambled: Combina dos valores (P y S)
+    Operaciones:
+    1. XOR entre x e y
+    2. Suma con ((x AND mascara) OR (y desplazado))
+    """
+    return ((x ^ y) + ((x & 0xFFFF) | (y << 16))) & MASK64
+
+def funcion_generacion(x, y):
+    """
+    Genera llave usando:
+    1. Rotación de bits de x (32 bits a derecha)
+    2. XOR con y
+    """
+    x &= MASK64
+    rotado = ((x >> 32) | (x << 32)) & MASK64
+    return rotado ^ y
+
+def funcion_mutacion(x, y):
+    """
+    Actualiza la semilla para próxima generación
+    Operaciones:
+    1. Suma x + y
+    2. XOR con ((x desplazado) OR (y desplazado))
+    """
+    return ((x + y) ^ ((x << 8) | (y >> 8))) & MASK64
+
+def programa_llaves(p, q, s):
+    """
+    Genera las 4 llaves en una sola llamada.
+    Equivale a aplicar f_mezcla, f_generacion y f_mutacion
+    por cada llave, con las operaciones en línea.
+    """
+    p_bajo = p & 0xFFFF  # Constante de f_mezcla
+    q_alto = q >> 8      # Constante de f_mutacion
+    llaves = []
+    for _ in range(4):
+        x = ((p ^ s) + (p_bajo | (s << 16))) & MASK64
+        llaves.append((((x >> 32) | (x << 32)) & MASK64) ^ q)
+        s = ((s + q) ^ ((s << 8) | q_alto)) & MASK64
+    return tuple(llaves)
+
+def cifrar_bloque(num, llave):
+    """
+    Cifra un bloque de 64 bits:
+    1. XOR con llave
+    2. Rotación 4 bits a la derecha
+    """
+    num ^= llave
+    return ((num >> 4) | (num << 60)) & MASK64
 
 class ClienteIoT:
     """Clase principal que implementa el cliente IoT"""
@@ -21,8 +152,14 @@ class ClienteIoT:
         # Identificador único del dispositivo (6 bits)
         self.id = random.randint(0, 63)
         
-        # Tabla de llaves para cifrado
-        self.llaves = []
+        # Cabeceras precalculadas por tipo: ID (6 bits) + Tipo (2 bits)
+        self._hdr_fcm = (self.id << 2) | FCM
+        self._hdr_rm = (self.id << 2) | RM
+        self._hdr_kum = (self.id << 2) | KUM
+        self._hdr_lcm = (self.id << 2) | LCM
+        
+        # Tabla de llaves para cifrado (uint64 contiguos)
+        self.llaves = array('Q')
         
         # Índice de la llave actual a usar
         self.llave_actual = 0
@@ -31,6 +168,14 @@ class ClienteIoT:
         self.p = 0  # Número primo P
         self.q = 0  # Número primo Q
         self.s = 0  # Semilla S
+        
+        # Búfer reutilizable para serializar mensajes (el mayor es FCM/KUM)
+        self._buf = bytearray(_TAM_PARAMS)
+        self._mv = memoryview(self._buf)
+        self._mv_rm = self._mv[:_RM.size]
+        
+        # Archivo rm.bin abierto una sola vez (se abre en el primer RM)
+        self._fd_rm = None
 
     # --- Métodos para generación de números primos ---
     def generar_primo(self, bits=16):
@@ -38,69 +183,39 @@ class ClienteIoT:
         Genera un número primo de bits 
         """
         while True:
-            # Generar número aleatorio
-            num = random.getrandbits(bits)
+            # Generar número aleatorio impar desde la entropía del sistema
+            num = int.from_bytes(os.urandom((bits + 7) // 8), 'big') >> (-bits % 8) | 1
             
-            # Verificar si es primo (chequeando divisibilidad)
-            if num > 1 and all(num % i != 0 for i in [2, 3, 5, 7, 11, 13]):
+            # Verificar primalidad (división + Miller-Rabin)
+            if _es_probable_primo(num):
                 return num
 
-    # --- Funciones criptográficas ---
-    def funcion_mezcla(self, x, y):
-        """
-        Función scrambled: Combina dos valores (P y S)
-        Operaciones:
-        1. XOR entre x e y
-        2. Suma con ((x AND mascara) OR (y desplazado))
-        """
-        return (x ^ y) + ((x & 0xFFFF) | (y << 16))
-    
-    def funcion_generacion(self, x, y):
-        """
-        Genera llave usando:
-        1. Rotación de bits de x (32 bits a derecha)
-        2. XOR con y
-        """
-        rotado = ((x >> 32) | (x << 32)) & 0xFFFFFFFFFFFFFFFF
-        return rotado ^ y
-    
-    def funcion_mutacion(self, x, y):
-        """
-        Actualiza la semilla para próxima generación
-        Operaciones:
-        1. Suma x + y
-        2. XOR con ((x desplazado) OR (y desplazado))
-        """
-        return (x + y) ^ ((x << 8) | (y >> 8))
+    # --- Funciones criptográficas (definidas a nivel de módulo) ---
+    funcion_mezcla = staticmethod(funcion_mezcla)
+    funcion_generacion = staticmethod(funcion_generacion)
+    funcion_mutacion = staticmethod(funcion_mutacion)
 
     # --- Generación de llaves ---
     def generar_llaves(self):
         """Genera la tabla de llaves usando P, Q y S"""
-        self.llaves = []  # Reiniciar tabla
-        s = self.s       # Usar semilla actual
+        p, q = self.p, self.q
+        self.llaves = array('Q', programa_llaves(p, q, self.s))
         
-        print("\n[GENERACIÓN DE LLAVES]")
-        print(f"P = {self.p} (bin: {bin(self.p)})")
-        print(f"Q = {self.q} (bin: {bin(self.q)})")
-        print(f"Semilla inicial S = {s} (bin: {bin(s)})")
-        
-        # Generar 4 llaves
-        for i in range(4):
-            # Paso 1: Mezclar P y S
-            p0 = self.funcion_mezcla(self.p, s)
-            
-            # Paso 2: Generar llave
-            llave = self.funcion_generacion(p0, self.q)
-            self.llaves.append(llave)
+        if DEBUG:
+            print("\n[GENERACIÓN DE LLAVES]")
+            print(f"P = {p} (bin: {bin(p)})")
+            print(f"Q = {q} (bin: {bin(q)})")
+            print(f"Semilla inicial S = {self.s} (bin: {bin(self.s)})")
             
-            # Paso 3: Actualizar semilla
-            s = self.funcion_mutacion(s, self.q)
-            
-            # Mostrar detalles
-            print(f"\nLlave K{i+1}:")
-            print(f"P0 = f_mezcla(P, S) = {p0} (bin: {bin(p0)})")
-            print(f"K{i+1} = f_generacion(P0, Q) = {llave} (bin: {bin(llave)})")
-            print(f"Nueva semilla S = f_mutacion(S, Q) = {s} (bin: {bin(s)})")
+            # Mostrar detalles (recalculando los pasos intermedios)
+            s = self.s
+            for i, llave in enumerate(self.llaves):
+                p0 = funcion_mezcla(p, s)
+                s = funcion_mutacion(s, q)
+                print(f"\nLlave K{i+1}:")
+                print(f"P0 = f_mezcla(P, S) = {p0} (bin: {bin(p0)})")
+                print(f"K{i+1} = f_generacion(P0, Q) = {llave} (bin: {bin(llave)})")
+                print(f"Nueva semilla S = f_mutacion(S, Q) = {s} (bin: {bin(s)})")
 
     # --- Manejo de mensajes ---
     def crear_fcm(self):
@@ -111,17 +226,20 @@ class ClienteIoT:
         # Generar parámetros iniciales
         self.p = self.generar_primo()
         self.q = self.generar_primo()
-        self.s = random.getrandbits(64)
+        self.s = _nueva_semilla()
         
         # Generar tabla de llaves
         self.generar_llaves()
         
-        # Crear archivo binario
+        # Armar mensaje completo en el búfer
+        # Cabecera: ID (6 bits) + Tipo (2 bits)
+        _HDR.pack_into(self._buf, 0, self._hdr_fcm)
+        # Parámetros P, Q, S (cada uno 64 bits)
+        _PQS.pack_into(self._buf, _HDR.size, self.p, self.q, self.s)
+        
+        # Crear archivo binario (una sola escritura)
         with open('fcm.bin', 'wb') as f:
-            # Cabecera: ID (6 bits) + Tipo (2 bits)
-            f.write(struct.pack('B', (self.id << 2) | TipoMensaje.FCM.value))
-            # Parámetros P, Q, S (cada uno 64 bits)
-            f.write(struct.pack('QQQ', self.p, self.q, self.s))
+            f.write(self._mv)
         
         # Crear archivo JSON para visualización
         datos = {
@@ -149,15 +267,31 @@ class ClienteIoT:
         1. XOR con llave
         2. Rotación de bits
         """
-        # Asegurar mensaje de 8 bytes (64 bits)
-        datos = mensaje.encode('utf-8').ljust(8, b'\x00')[:8]
-        num = int.from_bytes(datos, 'big')  # Convertir a número
+        # Tomar a lo sumo 8 bytes (64 bits)
+        datos = mensaje.encode('utf-8')
+        if len(datos) > 8:
+            datos = datos[:8]
+        # Convertir a número; el desplazamiento rellena con ceros a la derecha
+        num = int.from_bytes(datos, 'big') << (8 * (8 - len(datos)))
         
-        # Aplicar operaciones criptográficas
-        num ^= llave  # Operación XOR con llave
-        num = ((num >> 4) | (num << 60)) & 0xFFFFFFFFFFFFFFFF  # Rotación 4 bits derecha
+        # Aplicar operaciones criptográficas (XOR + rotación)
+        return cifrar_bloque(num, llave)
+
+    def cifrar_lote(self, mensajes):
+        """
+        Cifra varios mensajes en una sola pasada.
+        El mensaje i usa la llave (llave_actual + i) % 4,
+        igual que si se enviaran uno a uno con crear_rm
+        """
+        # Llaves en el orden de uso, a partir de la actual
+        orden = self.llaves[self.llave_actual:] + self.llaves[:self.llave_actual]
         
-        return num
+        cifrados = []
+        for mensaje, llave in zip(mensajes, cycle(orden)):
+            datos = mensaje.encode('utf-8')[:8]
+            num = int.from_bytes(datos, 'big') << (8 * (8 - len(datos)))
+            cifrados.append(cifrar_bloque(num, llave))
+        return cifrados
 
     def crear_rm(self, mensaje):
         """Crea mensaje regular cifrado (RM)"""
@@ -171,36 +305,43 @@ class ClienteIoT:
         # Cifrar mensaje
         cifrado = self.cifrar_mensaje(mensaje, llave)
         
-        # Guardar en binario
-        with open('rm.bin', 'wb') as f:
-            f.write(struct.pack('B', (self.id << 2) | TipoMensaje.RM.value))  # Cabecera
-            f.write(struct.pack('B', self.llave_actual))  # Índice llave
-            f.write(struct.pack('Q', cifrado))  # Mensaje cifrado
+        # Cabecera, índice de llave y mensaje cifrado en el búfer
+        _RM.pack_into(self._buf, 0, self._hdr_rm, self.llave_actual, cifrado)
         
-        # Guardar en JSON
-        datos = {
-            "id": self.id,
-            "tipo": "RM",
-            "llave_usada": {
-                "indice": self.llave_actual,
-                "valor": hex(llave),
-                "valor_bin": bin(llave)
-            },
-            "mensaje_original": mensaje,
-            "mensaje_cifrado": {
-                "hex": hex(cifrado),
-                "bin": bin(cifrado)
-            },
-            "proceso_cifrado": [
-                "1. Convertir mensaje a numero de 64 bits",
-                "2. Aplicar XOR con llave",
-                "3. Rotar 4 bits a la derecha"
-            ]
-        }
-        with open('rm.json', 'w') as f:
-            json.dump(datos, f, indent=2)
+        # Guardar en binario sobre el archivo ya abierto (sin búfer intermedio,
+        # el servidor ve los datos apenas se escriben)
+        if self._fd_rm is None:
+            self._fd_rm = open('rm.bin', 'wb', buffering=0)
+        self._fd_rm.seek(0)
+        self._fd_rm.write(self._mv_rm)
+        
+        # Registro JSON opcional (una línea por mensaje en rm.jsonl)
+        if LOG_JSON:
+            datos = {
+                "id": self.id,
+                "tipo": "RM",
+                "llave_usada": {
+                    "indice": self.llave_actual,
+                    "valor": hex(llave),
+                    "valor_bin": bin(llave)
+                },
+                "mensaje_original": mensaje,
+                "mensaje_cifrado": {
+                    "hex": hex(cifrado),
+                    "bin": bin(cifrado)
+                },
+                "proceso_cifrado": [
+                    "1. Convertir mensaje a numero de 64 bits",
+                    "2. Aplicar XOR con llave",
+                    "3. Rotar 4 bits a la derecha"
+                ]
+            }
+            with open('rm.jsonl', 'a') as f:
+                f.write(json.dumps(datos, separators=(',', ':')) + '\n')
         
-        print("\n[RM CREADO] Detalles en rm.json")
+        print("\n[RM CREADO]")
+        if LOG_JSON:
+            print("Detalles en rm.jsonl")
         
         # Rotar llave para próximo mensaje
         self.llave_actual = (self.llave_actual + 1) % 4
@@ -210,15 +351,18 @@ class ClienteIoT:
         # Generar nuevos parámetros
         self.p = self.generar_primo()
         self.q = self.generar_primo()
-        self.s = random.getrandbits(64)
+        self.s = _nueva_semilla()
         
         # Generar nuevas llaves
         self.generar_llaves()
         
-        # Guardar en binario
+        # Armar mensaje completo en el búfer
+        _HDR.pack_into(self._buf, 0, self._hdr_kum)
+        _PQS.pack_into(self._buf, _HDR.size, self.p, self.q, self.s)
+        
+        # Guardar en binario (una sola escritura)
         with open('kum.bin', 'wb') as f:
-            f.write(struct.pack('B', (self.id << 2) | TipoMensaje.KUM.value))
-            f.write(struct.pack('QQQ', self.p, self.q, self.s))
+            f.write(self._mv)
         
         # Guardar en JSON
         datos = {
@@ -241,7 +385,7 @@ class ClienteIoT:
         """Crea mensaje de último contacto (LCM)"""
         # Solo necesita cabecera con ID y tipo
         with open('lcm.bin', 'wb') as f:
-            f.write(struct.pack('B', (self.id << 2) | TipoMensaje.LCM.value))
+            f.write(_HDR.pack(self._hdr_lcm))
         
         # Guardar en JSON
         datos = {
@@ -253,14 +397,37 @@ class ClienteIoT:
             json.dump(datos, f, indent=2)
         
         # Limpiar estado
-        self.llaves = []
+        self.llaves = array('Q')
+        if self._fd_rm is not None:
+            self._fd_rm.close()
+            self._fd_rm = None
         print("\n[LCM CREADO] Conexion terminada. Detalles en lcm.json")
 
 # --- Interfaz de usuario ---
-def main():
-    """Función principal con menú interactivo"""
-    cliente = ClienteIoT()
-    
+def despachar_lote(cliente, acciones):
+    """
+    Ejecuta acciones sin menú, en orden.
+    Formato: fcm, rm:<mensaje>, kum, lcm
+    """
+    for accion in acciones:
+        tipo, _, mensaje = accion.partition(':')
+        tipo = tipo.lower()
+        
+        if tipo == "fcm":
+            cliente.crear_fcm()
+        elif tipo in ("rm", "kum", "lcm") and not cliente.llaves:
+            print(f"{accion}: Primero debe establecer conexión (FCM)")
+        elif tipo == "rm":
+            cliente.crear_rm(mensaje)
+        elif tipo == "kum":
+            cliente.crear_kum()
+        elif tipo == "lcm":
+            cliente.crear_lcm()
+        else:
+            print(f"Acción no válida: {accion}")
+
+def menu_interactivo(cliente):
+    """Menú interactivo por consola"""
     while True:
         print("\n=== MENÚ CLIENTE IoT ===")
         print("1. Primer contacto (FCM)")
@@ -294,5 +461,20 @@ def main():
         else:
             print("Opción no válida")
 
+def main():
+    """
+    Función principal.
+    Sin argumentos (o con --interactive) muestra el menú;
+    con argumentos ejecuta las acciones en lote, p. ej.:
+        python iot_client.py fcm rm:hola rm:mundo kum lcm
+    """
+    cliente = ClienteIoT()
+    acciones = sys.argv[1:]
+    
+    if acciones and acciones != ["--interactive"]:
+        despachar_lote(cliente, acciones)
+    else:
+        menu_interactivo(cliente)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
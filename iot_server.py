@@ -1,37 +1,78 @@
 
 import struct
 import json
-from enum import Enum
+import sys
+from array import array
 
-# Definición de tipos de mensaje
-class TipoMensaje(Enum):
-    """Enumera los tipos de mensajes del protocolo"""
-    FCM = 0  # First Contact Message
-    RM = 1   # Regular Message
-    KUM = 2  # Key Update Message
-    LCM = 3  # Last Contact Message
+# Tipos de mensajes del protocolo (2 bits de la cabecera)
+FCM = 0  # First Contact Message
+RM = 1   # Regular Message
+KUM = 2  # Key Update Message
+LCM = 3  # Last Contact Message
+
+# Mostrar detalles internos (llaves, valores binarios) por consola
+DEBUG = False
+
+# Registrar cada RM en formato JSON (rm_server.jsonl); apagado por defecto
+LOG_JSON = False
+
+# Formatos precompilados de los mensajes (iguales que en cliente)
+_U64 = struct.Struct('>Q')    # Bloque de 64 bits big-endian del mensaje
+_HDR = struct.Struct('B')     # Cabecera: ID (6 bits) + Tipo (2 bits)
+_PQS = struct.Struct('QQQ')   # Parámetros P, Q, S
+_RM = struct.Struct('=BBQ')   # Cabecera + índice de llave + cifrado (sin relleno)
+_TAM_PARAMS = _HDR.size + _PQS.size  # Tamaño de FCM/KUM (25 bytes)
+
+# --- Funciones criptográficas ---
+# Todas las operaciones trabajan sobre enteros de 64 bits
+MASK64 = (1 << 64) - 1
+
+def funcion_mezcla(x, y):
+    """Igual que en cliente: Combina x e y con XOR y operaciones de bits"""
+    return ((x ^ y) + ((x & 0xFFFF) | (y << 16))) & MASK64
+
+def funcion_generacion(x, y):
+    """Igual que en cliente: Genera llave con rotación y XOR"""
+    x &= MASK64
+    rotado = ((x >> 32) | (x << 32)) & MASK64
+    return rotado ^ y
+
+def funcion_mutacion(x, y):
+    """Igual que en cliente: Actualiza semilla para próxima llave"""
+    return ((x + y) ^ ((x << 8) | (y >> 8))) & MASK64
+
+def programa_llaves(p, q, s):
+    """Igual que en cliente: Genera las 4 llaves en una sola llamada"""
+    p_bajo = p & 0xFFFF  # Constante de f_mezcla
+    q_alto = q >> 8      # Constante de f_mutacion
+    llaves = []
+    for _ in range(4):
+        x = ((p ^ s) + (p_bajo | (s << 16))) & MASK64
+        llaves.append((((x >> 32) | (x << 32)) & MASK64) ^ q)
+        s = ((s + q) ^ ((s << 8) | q_alto)) & MASK64
+    return tuple(llaves)
+
+def descifrar_bloque(cifrado, llave):
+    """
+    Inverso de cifrar_bloque del cliente:
+    1. Rotación 4 bits a la izquierda
+    2. XOR con llave
+    """
+    num = ((cifrado << 4) | (cifrado >> 60)) & MASK64
+    return num ^ llave
 
 class ServidorIoT:
     """Clase principal que implementa el servidor IoT"""
     
     def __init__(self):
         """Inicializa el servidor con diccionario de clientes"""
-        # Estructura: {id: {'p': val, 'q': val, 's': val, 'llaves': [k1, k2, k3, k4]}}
+        # Estructura: {id: {'p': val, 'q': val, 's': val, 'llaves': array('Q', [k1, k2, k3, k4])}}
         self.clientes = {}
 
-    # --- Funciones criptográficas ---
-    def funcion_mezcla(self, x, y):
-        """Igual que en cliente: Combina x e y con XOR y operaciones de bits"""
-        return (x ^ y) + ((x & 0xFFFF) | (y << 16))
-    
-    def funcion_generacion(self, x, y):
-        """Igual que en cliente: Genera llave con rotación y XOR"""
-        rotado = ((x >> 32) | (x << 32)) & 0xFFFFFFFFFFFFFFFF
-        return rotado ^ y
-    
-    def funcion_mutacion(self, x, y):
-        """Igual que en cliente: Actualiza semilla para próxima llave"""
-        return (x + y) ^ ((x << 8) | (y >> 8))
+    # --- Funciones criptográficas (definidas a nivel de módulo) ---
+    funcion_mezcla = staticmethod(funcion_mezcla)
+    funcion_generacion = staticmethod(funcion_generacion)
+    funcion_mutacion = staticmethod(funcion_mutacion)
 
     # --- Generación de llaves ---
     def generar_llaves(self, p, q, s):
@@ -39,23 +80,14 @@ class ServidorIoT:
         Genera tabla de llaves usando los 
         parámetros p, q y s iniciales
         """
-        llaves = []
-        print("\n[GENERANDO LLAVES EN SERVIDOR]")
-        print(f"Usando P={p}, Q={q}, S={s}")
+        llaves = array('Q', programa_llaves(p, q, s))
         
-        for i in range(4):
-            # Paso 1: Mezclar P y S
-            p0 = self.funcion_mezcla(p, s)
-            
-            # Paso 2: Generar llave
-            llave = self.funcion_generacion(p0, q)
-            llaves.append(llave)
-            
-            # Paso 3: Actualizar semilla
-            s = self.funcion_mutacion(s, q)
-            
-            # Mostrar información
-            print(f"K{i+1}: {hex(llave)} (bin: {bin(llave)})")
+        # Mostrar información
+        if DEBUG:
+            print("\n[GENERANDO LLAVES EN SERVIDOR]")
+            print(f"Usando P={p}, Q={q}, S={s}")
+            for i, llave in enumerate(llaves):
+                print(f"K{i+1}: {hex(llave)} (bin: {bin(llave)})")
         
         return llaves
 
@@ -65,17 +97,21 @@ class ServidorIoT:
         try:
             print("\n[PROCESANDO FCM]")
             
-            # Leer archivo binario
-            with open('fcm.bin', 'rb') as f:
-                cabecera = struct.unpack('B', f.read(1))[0]
-                p, q, s = struct.unpack('QQQ', f.read(24))
+            # Leer archivo binario completo con una sola llamada read (sin búfer)
+            with open('fcm.bin', 'rb', buffering=0) as f:
+                buf = f.read(_TAM_PARAMS)
+            if len(buf) < _TAM_PARAMS:
+                print("Error: fcm.bin incompleto")
+                return
+            cabecera = buf[0]
+            p, q, s = _PQS.unpack_from(buf, _HDR.size)
             
             # Extraer ID y tipo de cabecera
             id_cliente = cabecera >> 2
             tipo = cabecera & 0b11
             
             # Validar tipo de mensaje
-            if tipo != TipoMensaje.FCM.value:
+            if tipo != FCM:
                 print("Error: No es un mensaje FCM válido")
                 return
             
@@ -119,30 +155,38 @@ class ServidorIoT:
         1. Rotación inversa (4 bits izquierda)
         2. XOR con llave (mismo que cifrado)
         """
-        # Rotación inversa
-        num = ((cifrado << 4) | (cifrado >> 60)) & 0xFFFFFFFFFFFFFFFF
-        # XOR con llave
-        num ^= llave
-        # Convertir a texto
-        return num.to_bytes(8, 'big').decode('utf-8').strip('\x00')
+        # Rotación inversa + XOR con llave
+        num = descifrar_bloque(cifrado, llave)
+        # Convertir a texto, cortando en el primer byte de relleno
+        datos = _U64.pack(num)
+        fin = datos.find(b'\x00')
+        if fin >= 0:
+            datos = datos[:fin]
+        try:
+            return datos.decode('ascii')  # Caso común: texto ASCII
+        except UnicodeDecodeError:
+            # UTF-8 (p. ej. 'ñ'); un carácter cortado a los 8 bytes se reemplaza
+            return datos.decode('utf-8', 'replace')
 
     def procesar_rm(self):
         """Procesa mensaje regular cifrado (RM)"""
         try:
             print("\n[PROCESANDO RM]")
             
-            # Leer archivo binario
-            with open('rm.bin', 'rb') as f:
-                cabecera = struct.unpack('B', f.read(1))[0]
-                idx_llave = struct.unpack('B', f.read(1))[0]
-                cifrado = struct.unpack('Q', f.read(8))[0]
+            # Leer archivo binario completo con una sola llamada read (sin búfer)
+            with open('rm.bin', 'rb', buffering=0) as f:
+                buf = f.read(_RM.size)
+            if len(buf) < _RM.size:
+                print("Error: rm.bin incompleto")
+                return
+            cabecera, idx_llave, cifrado = _RM.unpack(buf)
             
             # Extraer ID y tipo
             id_cliente = cabecera >> 2
             tipo = cabecera & 0b11
             
             # Validar tipo
-            if tipo != TipoMensaje.RM.value:
+            if tipo != RM:
                 print("Error: No es un mensaje RM válido")
                 return
             
@@ -156,32 +200,35 @@ class ServidorIoT:
             
             # Obtener llave correspondiente
             llave = self.clientes[id_cliente]['llaves'][idx_llave]
-            print(f"Llave usada: {hex(llave)}")
+            if DEBUG:
+                print(f"Llave usada: {hex(llave)}")
             
             # Descifrar mensaje
             mensaje = self.descifrar_mensaje(cifrado, llave)
             
-            # Guardar en JSON
-            datos = {
-                "id_cliente": id_cliente,
-                "llave_usada": {
-                    "indice": idx_llave,
-                    "valor": hex(llave)
-                },
-                "mensaje_cifrado": hex(cifrado),
-                "mensaje_descifrado": mensaje,
-                "proceso_descifrado": [
-                    "1. Rotar 4 bits a la izquierda",
-                    "2. Aplicar XOR con llave",
-                    "3. Convertir bytes a texto"
-                ],
-                "status": "Mensaje descifrado"
-            }
-            with open('rm_server.json', 'w') as f:
-                json.dump(datos, f, indent=2)
+            # Registro JSON opcional (una línea por mensaje en rm_server.jsonl)
+            if LOG_JSON:
+                datos = {
+                    "id_cliente": id_cliente,
+                    "llave_usada": {
+                        "indice": idx_llave,
+                        "valor": hex(llave)
+                    },
+                    "mensaje_cifrado": hex(cifrado),
+                    "mensaje_descifrado": mensaje,
+                    "proceso_descifrado": [
+                        "1. Rotar 4 bits a la izquierda",
+                        "2. Aplicar XOR con llave",
+                        "3. Convertir bytes a texto"
+                    ],
+                    "status": "Mensaje descifrado"
+                }
+                with open('rm_server.jsonl', 'a') as f:
+                    f.write(json.dumps(datos, separators=(',', ':')) + '\n')
             
             print(f"[MENSAJE DESCIFRADO]: '{mensaje}'")
-            print("Detalles en rm_server.json")
+            if LOG_JSON:
+                print("Detalles en rm_server.jsonl")
             
         except FileNotFoundError:
             print("Error: No se encontró rm.bin")
@@ -191,17 +238,21 @@ class ServidorIoT:
         try:
             print("\n[PROCESANDO KUM]")
             
-            # Leer archivo binario
-            with open('kum.bin', 'rb') as f:
-                cabecera = struct.unpack('B', f.read(1))[0]
-                p, q, s = struct.unpack('QQQ', f.read(24))
+            # Leer archivo binario completo con una sola llamada read (sin búfer)
+            with open('kum.bin', 'rb', buffering=0) as f:
+                buf = f.read(_TAM_PARAMS)
+            if len(buf) < _TAM_PARAMS:
+                print("Error: kum.bin incompleto")
+                return
+            cabecera = buf[0]
+            p, q, s = _PQS.unpack_from(buf, _HDR.size)
             
             # Extraer ID y tipo
             id_cliente = cabecera >> 2
             tipo = cabecera & 0b11
             
             # Validar tipo
-            if tipo != TipoMensaje.KUM.value:
+            if tipo != KUM:
                 print("Error: No es un mensaje KUM válido")
                 return
             
@@ -250,15 +301,19 @@ class ServidorIoT:
             print("\n[PROCESANDO LCM]")
             
             # Leer archivo binario (solo 1 byte)
-            with open('lcm.bin', 'rb') as f:
-                cabecera = struct.unpack('B', f.read(1))[0]
+            with open('lcm.bin', 'rb', buffering=0) as f:
+                buf = f.read(_HDR.size)
+            if not buf:
+                print("Error: lcm.bin incompleto")
+                return
+            cabecera = buf[0]
             
             # Extraer ID y tipo
             id_cliente = cabecera >> 2
             tipo = cabecera & 0b11
             
             # Validar tipo
-            if tipo != TipoMensaje.LCM.value:
+            if tipo != LCM:
                 print("Error: No es un mensaje LCM válido")
                 return
             
@@ -286,10 +341,26 @@ class ServidorIoT:
             print("Error: No se encontró lcm.bin")
 
 # --- Interfaz de usuario ---
-def main():
-    """Función principal con menú interactivo"""
-    servidor = ServidorIoT()
-    
+def despachar_lote(servidor, acciones):
+    """
+    Procesa mensajes sin menú, en orden.
+    Formato: fcm, rm, kum, lcm
+    """
+    procesar = {
+        "fcm": servidor.procesar_fcm,
+        "rm": servidor.procesar_rm,
+        "kum": servidor.procesar_kum,
+        "lcm": servidor.procesar_lcm
+    }
+    for accion in acciones:
+        funcion = procesar.get(accion.lower())
+        if funcion is None:
+            print(f"Acción no válida: {accion}")
+        else:
+            funcion()
+
+def menu_interactivo(servidor):
+    """Menú interactivo por consola"""
     while True:
         print("\n=== MENÚ SERVIDOR IoT ===")
         print("1. Procesar FCM (Primer contacto)")
@@ -313,5 +384,20 @@ def main():
         else:
             print("Opción no válida")
 
+def main():
+    """
+    Función principal.
+    Sin argumentos (o con --interactive) muestra el menú;
+    con argumentos procesa los mensajes en lote, p. ej.:
+        python iot_server.py fcm rm kum lcm
+    """
+    servidor = ServidorIoT()
+    acciones = sys.argv[1:]
+    
+    if acciones and acciones != ["--interactive"]:
+        despachar_lote(servidor, acciones)
+    else:
+        menu_interactivo(servidor)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file